@@ -1,18 +1,77 @@
+import os
+import mmap
+import multiprocessing
 import re
 import json
 import sys
 import time
 import string
+import numpy as np
 from mpi4py import MPI
 
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    # orjson not installed - use the standard library parser
+    json_loads = json.loads
+
+try:
+    import ahocorasick
+except ImportError:
+    # pyahocorasick not installed - phrasal words are matched one regex at a time
+    ahocorasick = None
+
+try:
+    import numba
+except ImportError:
+    # numba not installed - grids are looked up with NumPy broadcasting instead
+    numba = None
+
 
 # data structure for storing all words
 sentimentWords = {}
 # data structure for 'phrasal' terms
 phrasal_words = {}
+# automaton matching all phrasal terms in a single pass over a tweet
+phrasal_automaton = None
+# lowercased first word of each phrasal term mapping to the phrasal terms starting with it
+phrasal_first_words = {}
 # grid Id mapping to tweet counts and tweet scores
 gridBoundary = {}
+# grid boundaries as arrays (one entry per grid, in gridBoundary order) for batch lookups
+grid_ids = []
+grid_xmin = None
+grid_xmax = None
+grid_ymin = None
+grid_ymax = None
+grid_edge_x = None
+grid_edge_y = None
+# lower bounds with the edge flags folded in, so that a strict > test includes the edge
+grid_xlo = None
+grid_ylo = None
 MASTER_RANK = 0
+# number of tweets whose grids are looked up together
+BATCH_SIZE = 10000
+# size of the pieces of a processor's byte range handed to its worker processes
+CHUNK_BYTES = 64 * 1024 * 1024
+
+# grids on the left/bottom extremity of the map - tweets lying exactly on their
+# xmin/ymin edge are counted in them
+EDGE_XMIN_GRIDS = {"A1", "B1", "C1", "D3"}
+EDGE_YMIN_GRIDS = {"C1", "C2", "D3", "D4", "D5"}
+
+# characters (besides whitespace) allowed directly before a phrasal word
+PHRASE_LEFT_BOUNDARY = frozenset("\"'")
+# quotes stripped from the start of a word before it is looked up
+WORD_QUOTES = "\"'"
+
+# patterns for cleaning up tweet lines, compiled once rather than per tweet
+_RE_TRAIL = re.compile("}},(\r|\n)+")
+_RE_SOURCE = re.compile('"source": "<a.*?>.*?</a>"')
+_RE_END = re.compile(r"}}]}$")
+# patterns for extracting words from tweet text
+_WORD_RE = re.compile(r"[\"']*[a-zA-Z\-']+[?!\"'.,]*")
+_LEAD_QUOTE_RE = re.compile(r"^[\"']*")
 
 
 def main():
@@ -36,57 +95,61 @@ def main():
     # construct coordinates and sentiment words data structures including phrasal words
     getSentimentWords(sentiment_filename)
     getCoordinates(grid_filename)
-
-    if rank == 0:
-        print(f"Number of cores for this task is {size}\n")
-        # Master processor
-        master_tweet_processor(comm, twitter_filename)
-    else:
-        # Slave processor
-        slave_tweet_processor(comm, twitter_filename)
-
-    print("\n--- %s seconds ---\n" % (time.time() - startTime))
+    if numba is not None:
+        # compile the grid lookup now rather than on the first batch of tweets. The master
+        # compiles first and writes numba's on-disk cache so that the other processors
+        # load it rather than each compiling the same functions
+        if rank == MASTER_RANK:
+            getGrids(np.zeros(1), np.zeros(1))
+        comm.Barrier()
+        if rank != MASTER_RANK:
+            getGrids(np.zeros(1), np.zeros(1))
+
+    # cores on this node not taken by other processors are used by a pool of worker processes.
+    # Workers are forked after the data structures are built so they inherit them
+    workers = getWorkerCount(comm)
+    pool = multiprocessing.get_context("fork").Pool(workers) if workers > 1 else None
+
+    try:
+        if rank == 0:
+            print(f"Number of cores for this task is {size}\n")
+            # Master processor
+            master_tweet_processor(comm, twitter_filename, pool, workers)
+            print("\n--- %s seconds ---\n" % (time.time() - startTime))
+        else:
+            # Slave processor
+            slave_tweet_processor(comm, twitter_filename, pool, workers)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     return
 
 
-def update_counts(counts, total_counts):
-    """Combine total counts with counts to updated dictionary"""
-    for gridID in counts:
-        # if grid exists already, update counts
-        if gridID in total_counts:
-            total_counts[gridID]['tweetCount'] += counts[gridID]['tweetCount']
-            total_counts[gridID]['tweetScore'] += counts[gridID]['tweetScore']
+def getWorkerCount(comm):
+    """Returns the number of worker processes this processor should use - its share of
+    the cores that the processors on this node are allowed to run on."""
 
+    # processors running on this node
+    node_comm = comm.Split_type(MPI.COMM_TYPE_SHARED)
+    try:
+        local_size = node_comm.Get_size()
+        if hasattr(os, "sched_getaffinity"):
+            # processors may share cores (e.g. bound to a socket or to the job's cpuset) so
+            # count the cores any of them may use once
+            allowed = set().union(*node_comm.allgather(os.sched_getaffinity(0)))
+            cores = len(allowed)
         else:
-            # check if gridID exists in counts - grid key doesn't exist in total_group_counts so we can
-            # initialise it
-            result = {'tweetCount': counts[gridID]['tweetCount'], 'tweetScore': counts[gridID]['tweetScore']}
-            total_counts[gridID] = result
-            total_counts[gridID] = result
-
-    return total_counts
-
-
-def get_tweets(comm):
-    """Returns data to master processor when asked for it."""
-    total_slave_counts = {}
-    processes = comm.Get_size()
-
-    # Now ask all processes except ourselves to return counts
-    for i in range(processes-1):
-        # request sent to slave_tweet_processor function
-        comm.send('return_data', dest=i+1, tag=i+1)
-    # receive counts back from worker nodes and update total_counts_slaves
-    for i in range(processes-1):
-        # Receive data
-        total_slave_counts = update_counts(comm.recv(source=i+1, tag=MASTER_RANK), total_slave_counts)
+            cores = os.cpu_count() or 1
+    finally:
+        node_comm.Free()
 
-    return total_slave_counts
+    return max(cores // local_size, 1)
 
 
-def master_tweet_processor(comm, filename):
-    """Receives data from slave processors and combines it with the data it has processed.
+def master_tweet_processor(comm, filename, pool=None, workers=1):
+    """Sums data from slave processors with the data it has processed.
     Prints the result of this information to the prompt.
     Printed results are the total count of the tweet lengths measured by characters."""
 
@@ -94,58 +157,43 @@ def master_tweet_processor(comm, filename):
     rank = comm.Get_rank()
     size = comm.Get_size()
 
-    total_slave_counts = {}
-
     # get counts for rank = 0 - this function is only called in 'if' statement of main
-    # returns a dictionary of counts
-    counts_master = getResults(rank, filename, size)
-
-    if size > 1:
-        # getting tweets from slaves - see 'else' statement above
-        total_slave_counts = get_tweets(comm)
-
-        # turn everything off once data has been marshalled
-        for i in range(size-1):
-            # receive data
-            comm.send('exit', dest=(i+1), tag=(i+1))
+    # returns arrays of tweet counts and scores per grid
+    counts_master = np.stack(getResults(rank, filename, size, pool, workers))
 
-    if total_slave_counts:
-        counts_master = update_counts(counts_master, total_slave_counts)
+    # sum counts and scores over every processor in a single reduction
+    total_counts = np.zeros_like(counts_master)
+    comm.Reduce(counts_master, total_counts, op=MPI.SUM, root=MASTER_RANK)
+    tweet_counts, tweet_scores = total_counts
 
     spacing = " " * 4
 
     print(f"Cell{spacing}#Total Tweets{spacing}#Overall Sentiment Score")
-    for grid in sorted(counts_master.keys()):
-        count = counts_master[grid]['tweetCount']
-        score = counts_master[grid]['tweetScore']
-        print(f"{grid:<4}{count:^15}{score:^25}")
+    for grid in sorted(range(len(grid_ids)), key=lambda k: grid_ids[k]):
+        # grid without any tweets, leave it out
+        if tweet_counts[grid] == 0:
+            continue
+        gridID = grid_ids[grid]
+        count = int(tweet_counts[grid])
+        score = int(tweet_scores[grid])
+        print(f"{gridID:<4}{count:^15}{score:^25}")
 
     return
 
 
-def slave_tweet_processor(comm, filename):
+def slave_tweet_processor(comm, filename, pool=None, workers=1):
     """Each slave processor will process this function. Each processor will have a rank
     and we pass this rank and the size into the getResults function essentially getting that
-    core to process the data that we have allocated to it. It then, when asked by the get_tweets
-    function, will return the counts (associated with the rank) to the get_tweets function."""
+    core to process the data that we have allocated to it. It then returns the counts
+    (associated with the rank) to the master processor, where they are summed by MPI."""
     rank = comm.Get_rank()
     size = comm.Get_size()
 
-    # returns a dictionary of counts
-    counts = getResults(rank, filename, size)
-    # We wait to return our counts now that we have them
-    while True:
-        # receive request sent from get_tweets function
-        in_comm = comm.recv(source=MASTER_RANK, tag=rank)
-        # check if command is a string with instruction: 'return_data' or 'exit'
-        if isinstance(in_comm, str):
-            # 'return_data' reflects the parameter data passed in
-            if in_comm in "return_data":
-                # send data back
-                comm.send(counts, dest=MASTER_RANK, tag=MASTER_RANK)
-            # terminates that processor/core's program
-            elif in_comm in "exit":
-                exit(0)
+    # returns arrays of tweet counts and scores per grid
+    counts = np.stack(getResults(rank, filename, size, pool, workers))
+    # add our counts and scores into the master processor's totals - with a tree reduction
+    # ranks that finish early can combine their counts while the master is still working
+    comm.Reduce(counts, None, op=MPI.SUM, root=MASTER_RANK)
 
     return
 
@@ -156,6 +204,8 @@ def getSentimentWords(filename):
 
     global sentimentWords
     global phrasal_words
+    global phrasal_automaton
+    global phrasal_first_words
 
     unique_words = set()
 
@@ -183,10 +233,19 @@ def getSentimentWords(filename):
         word = key.split()
         if len(word) > 1:
             phrasal_words[key] = sentimentWords[key]
+            phrasal_first_words.setdefault(word[0].lower(), []).append(key)
             # get individual word of phrasal words
             for w in word:
                 unique_words.add(w)
 
+    # build automaton of lowercased phrasal words so each tweet is scanned once for all of them
+    if ahocorasick is not None and phrasal_words:
+        phrasal_automaton = ahocorasick.Automaton()
+        for phrase, score in phrasal_words.items():
+            key = phrase.lower()
+            phrasal_automaton.add_word(key, (phrase, score, len(key)))
+        phrasal_automaton.make_automaton()
+
     return
 
 
@@ -196,6 +255,8 @@ def getCoordinates(filename):
     coordinates."""
 
     global gridBoundary
+    global grid_ids, grid_xmin, grid_xmax, grid_ymin, grid_ymax, grid_edge_x, grid_edge_y
+    global grid_xlo, grid_ylo
     with open(filename, "r") as f:
         grid = json.load(f)
     features = grid["features"]
@@ -209,9 +270,25 @@ def getCoordinates(filename):
         x_max = properties["xmax"]
         y_min = properties["ymin"]
         y_max = properties["ymax"]
+        # whether tweets on the left/bottom edge belong to this grid
+        include_xmin = gridID in EDGE_XMIN_GRIDS
+        include_ymin = gridID in EDGE_YMIN_GRIDS
 
         # get boundary values for each grid
-        gridBoundary[gridID] = (x_min, x_max, y_min, y_max)
+        gridBoundary[gridID] = (x_min, x_max, y_min, y_max, include_xmin, include_ymin)
+
+    # same boundaries as arrays for getGrids
+    grid_ids = list(gridBoundary)
+    bounds = [gridBoundary[gridID] for gridID in grid_ids]
+    grid_xmin = np.array([b[0] for b in bounds], dtype=np.float64)
+    grid_xmax = np.array([b[1] for b in bounds], dtype=np.float64)
+    grid_ymin = np.array([b[2] for b in bounds], dtype=np.float64)
+    grid_ymax = np.array([b[3] for b in bounds], dtype=np.float64)
+    grid_edge_x = np.array([b[4] for b in bounds], dtype=bool)
+    grid_edge_y = np.array([b[5] for b in bounds], dtype=bool)
+    # x > nextafter(xmin, -inf) is the same as x >= xmin for floats
+    grid_xlo = np.where(grid_edge_x, np.nextafter(grid_xmin, -np.inf), grid_xmin)
+    grid_ylo = np.where(grid_edge_y, np.nextafter(grid_ymin, -np.inf), grid_ymin)
 
     return gridBoundary
 
@@ -220,60 +297,127 @@ def tweet_to_json(tweet):
     """Cleans string of 'nuisance' characters to create properly
     formatted JSON string for reading"""
 
-    tweet = re.sub("}},(\r|\n)+", "}}", tweet)
-    tweet = re.sub('"source": "<a.*?>.*?</a>"', '"source":""', tweet)
-    tweet = re.sub(r"}}]}$", "}}", tweet)
+    tweet = _RE_TRAIL.sub("}}", tweet)
+    tweet = _RE_SOURCE.sub('"source":""', tweet)
+    tweet = _RE_END.sub("}}", tweet)
     tweet = json.loads(tweet)
 
     return tweet
 
 
-def getResults(rank, filename, processes):
-    """Process Twitter data for given rank and number of processes.
-    Read data into memory for given worker node and process the data.
-    Return a dictionary of results for those tweets processed by the given processor."""
+def parseTweet(line):
+    """Parses a line (bytes) of the twitter file. Rows are valid JSON once the trailing
+    comma and line break are removed, so they go straight to the JSON parser; any line
+    that fails is cleaned up by tweet_to_json instead."""
+
+    row = line.rstrip(b",\r\n")
+    if row.startswith(b"{"):
+        try:
+            return json_loads(row)
+        except ValueError:
+            pass
 
-    results = {}
+    return tweet_to_json(row.decode("utf-8"))
+
+
+def getResults(rank, filename, processes, pool=None, workers=1):
+    """Process Twitter data for given rank and number of processes.
+    The file is split into equal byte ranges, one per process, and only the lines
+    starting in this rank's range are processed. If a pool of worker processes is given the
+    range is split again into equal pieces of at most CHUNK_BYTES, a multiple of workers
+    of them so that every worker gets the same share, which are processed by the pool.
+    Return arrays of the tweet count and total sentiment score per grid (indexed like
+    grid_ids) for those tweets processed by the given processor."""
+
+    # byte range of the file belonging to this rank
+    file_size = os.path.getsize(filename)
+    start = rank * file_size // processes
+    end = (rank + 1) * file_size // processes
+
+    if pool is None:
+        return processRange(filename, start, end)
+
+    # at least one piece per worker, rounded up to a whole number of pieces for each worker
+    chunks = max(workers, -(-(end - start) // CHUNK_BYTES))
+    chunks = -(-chunks // workers) * workers
+    bounds = [start + k * (end - start) // chunks for k in range(chunks + 1)]
+    tweet_counts = np.zeros(len(grid_ids), dtype=np.int64)
+    tweet_scores = np.zeros(len(grid_ids), dtype=np.int64)
+    ranges = [(filename, bounds[k], bounds[k + 1]) for k in range(chunks)]
+    for counts, scores in pool.starmap(processRange, ranges, chunksize=1):
+        tweet_counts += counts
+        tweet_scores += scores
+
+    return tweet_counts, tweet_scores
+
+
+def processRange(filename, start, end):
+    """Reads and processes the lines of the twitter file starting in the byte range
+    [start, end). Returns arrays of the tweet count and total sentiment score per grid."""
+
+    results = (np.zeros(len(grid_ids), dtype=np.int64), np.zeros(len(grid_ids), dtype=np.int64))
     total_tweets = 0
+    # tweets waiting for their grids to be looked up
+    batch_coordinates = []
+    batch_tweets = []
+
+    if start == end:
+        return results
+
+    with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        file_size = len(buffer)
+        position = start
+        if start > 0:
+            # skip the line straddling our start - it belongs to the previous range
+            position = buffer.find(b"\n", start - 1) + 1 or file_size
+
+        # stop at the first line starting in the next range
+        while position < end:
+            line_start = position
+            position = buffer.find(b"\n", line_start) + 1 or file_size
+            line = buffer[line_start:position]
+            try:
+                tweet = parseTweet(line)
+                total_tweets += 1
+                batch_coordinates.append(tweet["value"]["geometry"]["coordinates"])
+                batch_tweets.append(tweet["value"])
+            except ValueError as v:
+                print("\nMalformed JSON in tweet at byte ", line_start)
+                print(v)
+                print(f"Line of text is: {line.decode('utf-8', 'replace')}\n")
+
+            if len(batch_tweets) == BATCH_SIZE:
+                updateResults(batch_coordinates, batch_tweets, results)
+                batch_coordinates = []
+                batch_tweets = []
+
+    updateResults(batch_coordinates, batch_tweets, results)
 
-    with open(filename, "r") as file:
-        for i, tweet in enumerate(file):
-            line_count = i
-            # read in each line and execute the below for those lines which correspond to the rank of the
-            # core being executed
-            if line_count % processes == rank:
-                try:
-                    tweet = tweet_to_json(tweet)
-                    total_tweets += 1
-                    # division of tasks  -> process only those tweets corresponding to the rank of the processor where the
-                    # remainder is the row number divided by the number of processors (typically 8)
-                    # remainder will be 0-7 -> corresponds to the rank
-                    coordinates = tweet["value"]["geometry"]["coordinates"]
-                    tweetLocation = getGrid(coordinates)
-                    # tweet not in one of the grids, exclude it
-                    if tweetLocation == "not_found":
-                        continue
-                    else:
-                        # get text from tweet
-                        text = tweet["value"]["properties"]["text"]
-                        # compute score for tweet
-                        score = calculateSentimentScore(text)
-                        # if gridID already exists in results
-                        if tweetLocation in results:
-                            # increment number of tweets in that grid
-                            results[tweetLocation]["tweetCount"] += 1
-                            # add score to existing total score for that grid
-                            results[tweetLocation]["tweetScore"] += score
-
-                        # gridID not in results, initialise key
-                        else:
-                            # set list to [tweetCount, tweetScore]
-                            result = {"tweetCount": 1, "tweetScore": score}
-                            results[tweetLocation] = result
-                except ValueError as v:
-                    print("\nMalformed JSON in tweet ", i)
-                    print(v)
-                    print(f"Line of text is: {tweet}\n")
+    return results
+
+
+def updateResults(coordinates, tweets, results):
+    """Looks up the grids of a batch of tweets in one go and adds the count and
+    sentiment score of those tweets occurring in one of the grids to results."""
+
+    if not tweets:
+        return results
+
+    n = len(coordinates)
+    xs = np.fromiter((location[0] for location in coordinates), dtype=np.float64, count=n)
+    ys = np.fromiter((location[1] for location in coordinates), dtype=np.float64, count=n)
+    grids = getGrids(xs, ys)
+
+    # tweets not in one of the grids are excluded
+    in_grid = np.flatnonzero(grids >= 0)
+    grids = grids[in_grid]
+    # compute score for each tweet
+    scores = np.fromiter((calculateSentimentScore(tweets[i]["properties"]["text"]) for i in in_grid),
+                         dtype=np.int64, count=len(in_grid))
+
+    tweet_counts, tweet_scores = results
+    tweet_counts += np.bincount(grids, minlength=len(grid_ids))
+    np.add.at(tweet_scores, grids, scores)
 
     return results
 
@@ -294,122 +438,117 @@ def calculateSentimentScore(tweet):
     total = 0
     # store phrasal words found in tweet
     found = []
-    for word in phrasal_words:
-        pattern = r"(?:(?<=\s)|(?<=^)|(?<=[\"\']))(\b{}\b)(?=\s|$|[?!\"\'.,]*)".format(word)
-        matches = re.findall(pattern, tweet, flags=re.IGNORECASE)
-        if matches:
-            found.append(word)
-            multiplier = len(matches)
-            score = sentimentWords[word] * multiplier
+    # lowercase once for matching phrasal words
+    tweet_lower = tweet.lower()
+    if phrasal_automaton is not None:
+        # single pass over the tweet for all phrasal words - a match must be preceded by
+        # whitespace, a quote or the start of the tweet and not be followed by a word character
+        length = len(tweet_lower)
+        for end, (phrase, score, phrase_len) in phrasal_automaton.iter(tweet_lower):
+            start = end - phrase_len + 1
+            if start > 0:
+                before = tweet_lower[start - 1]
+                if not before.isspace() and before not in PHRASE_LEFT_BOUNDARY:
+                    continue
+            if end + 1 < length:
+                after = tweet_lower[end + 1]
+                if after.isalnum() or after == "_":
+                    continue
+            if phrase not in found:
+                found.append(phrase)
             total += score
+    else:
+        # only try the phrasal words whose first word appears in the tweet - a phrasal word
+        # may also start straight after a quote inside a token, so add those suffixes too
+        tweet_tokens = set()
+        for w in tweet_lower.split():
+            tweet_tokens.add(w)
+            if '"' in w or "'" in w:
+                tweet_tokens.update(w[i + 1:] for i, c in enumerate(w) if c in WORD_QUOTES)
+        candidates = [phrase for w in tweet_tokens for phrase in phrasal_first_words.get(w, ())]
+        for word in candidates:
+            pattern = r"(?:(?<=\s)|(?<=^)|(?<=[\"\']))(\b{}\b)(?=\s|$|[?!\"\'.,]*)".format(word.lower())
+            matches = re.findall(pattern, tweet_lower)
+            if matches:
+                found.append(word)
+                multiplier = len(matches)
+                score = sentimentWords[word] * multiplier
+                total += score
 
     # total to this point reflect score from 'phrasal' words matching
     # now split the tweet up on whitespace and iterate over list, finding those words whose pattern
     # matches the desired pattern. Look these words up in sentimentWords to get their score.
 
-    # tweet text - stored as list
+    # tweet text - stored as list. Words are taken from the original tweet since lowercasing
+    # can turn non-ASCII characters into ASCII ones the word regex would then accept
     tweet_words = tweet.split()
     for word in tweet_words:
-        pattern2 = f"[\"\']*[a-zA-Z-\']+[?!\"\'.,]*"
-        pattern_sub1 = r"^[\"\']*"
-        # pattern_sub2 = r"[?!\"\'.,]*"
-        match = re.match(pattern2, word)
-        if match is not None:
+        # common case - letters, hyphens and apostrophes wrapped in punctuation, where
+        # stripping the punctuation gives the same word as the regexes below
+        core = word.lstrip(WORD_QUOTES).rstrip(string.punctuation)
+        if core.isascii() and core.replace("-", "").replace("'", "").isalpha():
+            new_word = core.strip(string.punctuation).lower()
+        else:
+            match = _WORD_RE.match(word)
+            if match is None:
+                continue
             matched_word = match.group(0)
-            new_word = re.sub(pattern_sub1, "", matched_word)
+            new_word = _LEAD_QUOTE_RE.sub("", matched_word)
             new_word = new_word.strip(string.punctuation)
             new_word = new_word.lower()
-            if new_word in found:
-                continue
-            elif new_word in sentimentWords:
-                score = sentimentWords[new_word]
-                total += score
-            # word is not in sentiment words, skip it
-            else:
-                continue
+        if new_word in found:
+            continue
+        # single lookup - None when the word is not in sentiment words, skip it
+        score = sentimentWords.get(new_word)
+        if score is not None:
+            total += score
 
     return total
 
 
-def getGrid(location):
-    """Takes dictionary of id's and associated (x,y) values in a dictionary
-    and coordinates of the tweet and returns the grid ID in which the
-    tweet occurs if it indeed occurs within one of the locations. If tweet is outside
-    of the specific value then it is ignored.
-
-    Version 2: this consider the extremity points."""
-
-    tweet_x_coord = location[0]
-    tweet_y_coord = location[1]
-    for gridID in gridBoundary:
-        x_min, x_max, y_min, y_max = gridBoundary[gridID]
-        # for left extremity A1
-        if gridID == "A1":
-            if tweet_x_coord == x_min and y_min < tweet_y_coord <= y_max:
-                return gridID
-            elif x_min < tweet_x_coord <= x_max and y_min < tweet_y_coord <= y_max:
-                return gridID
-            else:
-                continue
+def getGrids(xs, ys):
+    """Finds the grids of a batch of tweets. Takes arrays of the tweets' x and y
+    coordinates and tests them against every grid at once. Tweets on the left/bottom
+    edge of an extremity grid (its include_xmin/include_ymin flags) count as inside it.
+    Returns an array holding, for each tweet, the index into grid_ids of the first grid
+    the tweet occurs in, or -1 if the tweet is outside all of the grids."""
 
-        elif gridID == "B1":
-            if tweet_x_coord == x_min and y_min < tweet_y_coord <= y_max:
-                return gridID
-            elif x_min < tweet_x_coord <= x_max and y_min < tweet_y_coord <= y_max:
-                return gridID
-            else:
-                continue
+    if numba is not None:
+        return _assign_grids(xs, ys, grid_xmin, grid_xmax, grid_ymin, grid_ymax, grid_edge_x, grid_edge_y)
 
-        elif gridID == "C1":
-            if tweet_x_coord == x_min and y_min < tweet_y_coord <= y_max:
-                return gridID
-            elif x_min < tweet_x_coord <= x_max and tweet_y_coord == y_min:
-                return gridID
-            elif x_min < tweet_x_coord <= x_max and y_min < tweet_y_coord <= y_max:
-                return gridID
-            else:
-                continue
+    xs = xs[:, None]
+    ys = ys[:, None]
+    # strictly inside the grid, or on the left/bottom edge of an extremity grid - the edges
+    # are already part of grid_xlo/grid_ylo so this is one test per bound
+    mask = (grid_xlo < xs) & (xs <= grid_xmax) & (grid_ylo < ys) & (ys <= grid_ymax)
 
-        elif gridID == "C2":
-            if tweet_y_coord == y_min:
-                return gridID
-            elif x_min < tweet_x_coord <= x_max and y_min < tweet_y_coord <= y_max:
-                return gridID
-            else:
-                continue
+    grids = mask.argmax(axis=1)
+    grids[~mask.any(axis=1)] = -1
 
-        elif gridID == "D3":
-            if tweet_x_coord == x_min and y_min < tweet_y_coord <= y_max:
-                return gridID
-            elif x_min < tweet_x_coord <= x_max and y_min == tweet_y_coord:
-                return gridID
-            elif x_min < tweet_x_coord <= x_max and y_min < tweet_y_coord <= y_max:
-                return gridID
-            else:
-                continue
+    return grids
 
-        elif gridID == "D4":
-            if tweet_y_coord == y_min:
-                return gridID
-            elif x_min < tweet_x_coord <= x_max and y_min < tweet_y_coord <= y_max:
-                return gridID
-            else:
-                continue
 
-        elif gridID == "D5":
-            if tweet_y_coord == y_min:
-                return gridID
-            elif x_min < tweet_x_coord <= x_max and y_min < tweet_y_coord <= y_max:
-                return gridID
-            else:
-                continue
+def _assign_grid(tx, ty, xmn, xmx, ymn, ymx, ixm, iym):
+    """Returns the index of the first grid containing the point (tx, ty), or -1."""
+    for k in range(xmn.shape[0]):
+        x_ok = (xmn[k] < tx <= xmx[k]) or (ixm[k] and tx == xmn[k])
+        y_ok = (ymn[k] < ty <= ymx[k]) or (iym[k] and ty == ymn[k])
+        if x_ok and y_ok:
+            return k
+    return -1
+
 
-        elif x_min < tweet_x_coord <= x_max and y_min < tweet_y_coord <= y_max:
-            return gridID
-    gridID = "not_found"
+def _assign_grids(xs, ys, xmn, xmx, ymn, ymx, ixm, iym):
+    """Runs _assign_grid over arrays of points, returning an int32 array of grid indices."""
+    grids = np.empty(xs.shape[0], dtype=np.int32)
+    for i in range(xs.shape[0]):
+        grids[i] = _assign_grid(xs[i], ys[i], xmn, xmx, ymn, ymx, ixm, iym)
+    return grids
 
-    return gridID
 
+if numba is not None:
+    _assign_grid = numba.njit(cache=True, boundscheck=False)(_assign_grid)
+    _assign_grids = numba.njit(cache=True, boundscheck=False)(_assign_grids)
 
 
 if __name__ == "__main__":